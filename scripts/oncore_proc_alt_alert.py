@@ -19,6 +19,7 @@ import json
 import os
 import sys
 import uuid
+from collections import deque
 from datetime import datetime, timedelta
 from pathlib import Path
 
@@ -29,6 +30,7 @@ from utils import (
     query_database,
     execute_database,
     send_email,
+    smtp_session,
     init_daily_logger,
     append_sent_records,
     send_failure_alert,
@@ -101,30 +103,66 @@ def save_state(path: Path, data: dict) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
     path.write_text(json.dumps(data, indent=2), encoding="utf-8")
 
-def load_sent_keys(s_path: Path) -> set[str]:
+def _sent_keys_path(s_path: Path) -> Path:
     suffix = "_dev" if s_path.stem.endswith("_dev") else ""
-    p = Path(str(s_path)).with_name(f"sent_keys{suffix}.json")
+    return Path(str(s_path)).with_name(f"sent_keys{suffix}.txt")
+
+def _load_legacy_sent_keys(p: Path) -> list[str]:
+    """Keys from the older sent_keys*.json format, used until the .txt file exists."""
+    try:
+        data = json.loads(p.with_suffix(".json").read_text(encoding="utf-8"))
+        return list(data.get("keys", []))
+    except Exception:
+        return []
+
+def load_sent_keys(s_path: Path) -> set[str]:
+    """Sent keys are stored one per line in an append-only text file."""
+    p = _sent_keys_path(s_path)
+    if not p.exists():
+        return set(_load_legacy_sent_keys(p))
     try:
-        data = json.loads(p.read_text(encoding="utf-8"))
-        return set(data.get("keys", []))
+        return set(p.read_text(encoding="utf-8").splitlines())
     except Exception:
         return set()
 
-def save_sent_keys(s_path: Path, keys: set[str], max_keep: int = 20000) -> None:
-    suffix = "_dev" if s_path.stem.endswith("_dev") else ""
-    p = Path(str(s_path)).with_name(f"sent_keys{suffix}.json")
+def save_sent_keys(s_path: Path, keys: set[str], new_keys: list[str], max_keep: int = 20000) -> None:
+    """
+    Append this run's new keys. The file is only rewritten, keeping the most
+    recent max_keep keys, once the known key count passes twice that limit.
+    """
+    p = _sent_keys_path(s_path)
     p.parent.mkdir(parents=True, exist_ok=True)
-    keys_list = sorted(keys)
-    if len(keys_list) > max_keep:
-        keys_list = keys_list[-max_keep:]
-    p.write_text(json.dumps({"keys": keys_list}, indent=2), encoding="utf-8")
+    if not p.exists():
+        new_keys = _load_legacy_sent_keys(p) + list(new_keys)
+    if new_keys:
+        with p.open("a", encoding="utf-8") as f:
+            f.write("".join(f"{k}\n" for k in new_keys))
+    if len(keys) > 2 * max_keep:
+        # Stream the file through a bounded deque so only the newest max_keep lines are held.
+        with p.open("r", encoding="utf-8") as f:
+            recent = deque(f, maxlen=max_keep)
+        p.write_text("".join(recent), encoding="utf-8")
 
 def _audit_table_fqn(dev_mode: bool) -> str:
     schema = AUDIT_SCHEMA_DEV if dev_mode else AUDIT_SCHEMA_PROD
     return f"{schema}.{AUDIT_TABLE}" if schema else AUDIT_TABLE
 
-def write_audit_event(*, dev_mode: bool, event_type: str, visit_id, modified_user_email: str,
-                      dedupe_key: str, job_run_id: str) -> None:
+def audit_event_params(*, event_type: str, visit_id, modified_user_email: str,
+                       dedupe_key: str, job_run_id: str) -> dict:
+    return {
+        "job_code": JOB_CODE,
+        "event_type": event_type,
+        "visit_id": str(visit_id) if visit_id is not None else None,
+        "modified_user_email": str(modified_user_email) if modified_user_email is not None else None,
+        "dedupe_key": dedupe_key,
+        "job_run_id": job_run_id,
+        "environment": os.getenv("ENVIRONMENT"),
+    }
+
+def write_audit_events(*, dev_mode: bool, rows: list) -> None:
+    """Insert all collected audit rows with one executemany() and a single commit."""
+    if not rows:
+        return
     table_fqn = _audit_table_fqn(dev_mode)
     sql = f"""
         INSERT INTO {table_fqn}
@@ -132,30 +170,16 @@ def write_audit_event(*, dev_mode: bool, event_type: str, visit_id, modified_use
         VALUES
             (SYSTIMESTAMP, :job_code, :event_type, :visit_id, :modified_user_email, :dedupe_key, :job_run_id, :environment)
     """
-    execute_database(
-        sql_query=sql,
-        db_type="oracle",
-        params={
-            "job_code": JOB_CODE,
-            "event_type": event_type,
-            "visit_id": str(visit_id) if visit_id is not None else None,
-            "modified_user_email": str(modified_user_email) if modified_user_email is not None else None,
-            "dedupe_key": dedupe_key,
-            "job_run_id": job_run_id,
-            "environment": os.getenv("ENVIRONMENT"),
-        },
-    )
+    execute_database(sql_query=sql, db_type="oracle", params=rows)
 
 # ==========================
 # SQL builder
 # ==========================
-def _fmt_ts(dt: datetime) -> str:
-    return dt.strftime("%Y-%m-%d %H:%M:%S")
-
-def build_sql(since_dt: datetime, until_dt: datetime) -> str:
+def build_sql() -> str:
     """
-    Use an open/closed window: (since, until]
-    NOTE: If COL_MODTS is a DATE (no time), switch TO_TIMESTAMP -> TO_DATE appropriately.
+    Use an open/closed window: (:since, :until]
+    The window bounds are bind variables so the statement text is identical
+    every run and Oracle can reuse the cached cursor (see window_params).
     """
     return f"""
         SELECT
@@ -169,31 +193,40 @@ def build_sql(since_dt: datetime, until_dt: datetime) -> str:
             {COL_VNAME}      AS visit_name,
             {COL_PROC}       AS clinical_procedure
         FROM {VIEW_FQN}
-        WHERE {COL_MODTS} >  TO_TIMESTAMP('{_fmt_ts(since_dt)}','YYYY-MM-DD HH24:MI:SS')
-          AND {COL_MODTS} <= TO_TIMESTAMP('{_fmt_ts(until_dt)}','YYYY-MM-DD HH24:MI:SS')
+        WHERE {COL_MODTS} >  :since
+          AND {COL_MODTS} <= :until
     """
 
+def window_params(since_dt: datetime, until_dt: datetime) -> dict:
+    # Bind as datetimes truncated to whole seconds, the same precision the window is logged at
+    return {
+        "since": since_dt.replace(microsecond=0),
+        "until": until_dt.replace(microsecond=0),
+    }
+
 # ==========================
 # Email HTML builders
 # ==========================
-def _fmt_date(val) -> str:
-    try:
-        return pd.to_datetime(val).strftime("%Y-%m-%d")
-    except Exception:
-        return str(val or "")
+def _fmt_dates(values: pd.Series) -> pd.Series:
+    """Format a whole date column in one vectorized pass; unparseable values become ''."""
+    return pd.to_datetime(values, errors="coerce").dt.strftime("%Y-%m-%d").fillna("")
+
+def _s(value):
+    """Blank for missing values; a plain None/NaN check is far cheaper than scalar pd.isna."""
+    return "" if value is None or value != value else value
 
 def _section_intro(modified_user_name, protocol_no, subject_name, visit_date, missed_count) -> str:
     return f"""
-      <p>Dear {'' if pd.isna(modified_user_name) else modified_user_name}</p>
+      <p>Dear {_s(modified_user_name)}</p>
       <p></p>
       <b>Issue Identified:</b>
       <p>
         The visit listed below includes an OnCore ePayment in which the ePayment was not confirmed. Without this confirmation, the ePayment cannot be processed and paid to the participant. 
       </p>
       <p>
-        <strong>Protocol:</strong> {'' if pd.isna(protocol_no) else protocol_no}<br/>
-        <strong>Subject:</strong> {'' if pd.isna(subject_name) else subject_name}<br/>
-        <strong>Visit Date:</strong> {_fmt_date(visit_date)}<br/>
+        <strong>Protocol:</strong> {_s(protocol_no)}<br/>
+        <strong>Subject:</strong> {_s(subject_name)}<br/>
+        <strong>Visit Date:</strong> {visit_date}<br/>
         <strong>Missed Procedures (count):</strong> {missed_count}
       </p>
     """
@@ -219,10 +252,12 @@ def _action_section() -> str:
 
 def _section_table(rows_df: pd.DataFrame) -> str:
     body_rows = "\n".join(
-        f"<tr><td>{_fmt_date(r['visit_date'])}</td>"
-        f"<td>{r.get('visit_name','')}</td>"
-        f"<td>{r.get('clinical_procedure','')}</td></tr>"
-        for _, r in rows_df.iterrows()
+        f"<tr><td>{visit_date}</td>"
+        f"<td>{visit_name}</td>"
+        f"<td>{clinical_procedure}</td></tr>"
+        for visit_date, visit_name, clinical_procedure in rows_df[
+            ["visit_date_fmt", "visit_name", "clinical_procedure"]
+        ].itertuples(index=False, name=None)
     )
     return (
         "<table style='border-collapse:collapse' border='1' cellpadding='6'>"
@@ -233,13 +268,14 @@ def _section_table(rows_df: pd.DataFrame) -> str:
 def build_visit_email_html(g: pd.DataFrame, since_dt: datetime, until_dt: datetime) -> str:
     """
     Build the email body for a single (visit_id, modified_user_email, modified_date) group.
+    Expects the normalized frame from main(): lowercase columns, rows already sorted
+    by visit_date/clinical_procedure, and a visit_date_fmt column.
     """
-    g = g.rename(columns=str.lower).copy().sort_values(["visit_date", "clinical_procedure"])
     last_row   = g.iloc[-1]  # metadata should be constant across rows for the group
     intro_html = _section_intro(last_row.get("modified_user_name"), last_row.get("protocol_no"), last_row.get("subject_name"),
-                                last_row.get("visit_date"), len(g))
+                                last_row.get("visit_date_fmt"), len(g))
     window_html = f"<p>Window: {since_dt:%Y-%m-%d %H:%M} → {until_dt:%Y-%m-%d %H:%M}</p>"
-    table_html  = _section_table(g[["visit_date","visit_name","clinical_procedure"]])
+    table_html  = _section_table(g[["visit_date_fmt","visit_name","clinical_procedure"]])
     action_html = _action_section()
     footer = (
     "<p style='color:#6a737d'>This email was generated automatically. "
@@ -302,9 +338,9 @@ def main(argv=None):
         logger.info(f"Window (open, closed]: {since.isoformat(timespec='seconds')} → {until.isoformat(timespec='seconds')}")
 
         # --------- Query ---------
-        sql = build_sql(since, until)
+        sql = build_sql()
         logger.info("Querying Oracle…")
-        df = query_database(sql_query=sql, db_type="oracle")
+        df = query_database(sql_query=sql, db_type="oracle", params=window_params(since, until))
         logger.info(f"Query complete. Rows returned: {0 if df is None else len(df)}")
 
         if df is None or df.empty:
@@ -315,88 +351,104 @@ def main(argv=None):
             return
 
         # --------- Normalize & load dedupe keys ---------
-        dfl = df.rename(columns=str.lower).copy()
+        # Lowercase + sort once up front; groupby(sort=False) keeps this row order within each group.
+        dfl = df.rename(columns=str.lower).sort_values(["visit_date", "clinical_procedure"], kind="mergesort")
+        dfl["visit_date_fmt"] = _fmt_dates(dfl["visit_date"])
+        dfl["modified_date"] = pd.to_datetime(dfl["modified_date"], errors="coerce")
         # Normalize to second precision so sub-second differences do not split one logical event.
-        dfl["modified_date_norm"] = pd.to_datetime(dfl["modified_date"]).dt.floor("s")
+        dfl["modified_date_norm"] = dfl["modified_date"].dt.floor("s")
+        # Few distinct visits/modifiers per run: group on category codes rather than hashing strings per row.
+        for c in ("visit_id", "modified_user_email"):
+            dfl[c] = dfl[c].astype("category")
+        # Idempotency key per row: visit + recipient + ts (seconds precision); constant within a group.
+        dfl["_mod_iso"] = dfl["modified_date_norm"].dt.strftime("%Y-%m-%dT%H:%M:%S")
+        dfl["_dedupe_key"] = (
+            dfl["visit_id"].astype(str) + "|"
+            + dfl["modified_user_email"].astype(str).replace("", "dev") + "|"
+            + dfl["_mod_iso"]
+        )
         sent_keys = load_sent_keys(s_path)
-        sent_rows = []
+        new_keys = []
+        sent_groups = []  # one record per email sent; joined back to the rows for the daily CSV
+
+        # --------- Drop rows that will not be sent before grouping, so no HTML is built for them ---------
+        # Rows without a modifier are kept in dev only, where send_email routes to DEV_EMAIL anyway.
+        no_modifier = (dfl["modified_user_email"].isna() | (dfl["modified_user_email"].astype(str) == "")) & (not dev_mode)
+        for visit_id in dfl.loc[no_modifier, "visit_id"].unique():
+            logger.warning(f"Skipping visit {visit_id}: empty MODIFIED_USER_EMAIL")
+        already_sent = ~no_modifier & dfl["_dedupe_key"].isin(sent_keys)
+        for dedupe_key in dfl.loc[already_sent, "_dedupe_key"].unique():
+            logger.info(f"Skip duplicate (key={dedupe_key})")
+        pending = dfl[~(no_modifier | already_sent)]
 
         # --------- Group & send: one email per (visit_id, modified_user_email, modified_date at second precision) ---------
         group_cols = ["visit_id", "modified_user_email", "modified_date_norm"]
-        for (visit_id, modifier, mod_ts), g in dfl.groupby(group_cols, dropna=False):
-
-            if not modifier and not dev_mode:
-                logger.warning(f"Skipping visit {visit_id}: empty MODIFIED_USER_EMAIL")
-                continue
-
-            # Idempotency key: visit + recipient + ts (seconds precision)
-            mod_dt = pd.to_datetime(mod_ts).to_pydatetime()
-            dedupe_key = f"{visit_id}|{modifier or 'dev'}|{mod_dt.isoformat(timespec='seconds')}"
-
-            if dedupe_key in sent_keys:
-                logger.info(f"Skip duplicate for visit {visit_id}, recipient {modifier}, ts {mod_dt} (key={dedupe_key})")
-                continue
-
-            missed_cnt = len(g)
-            subject = f"[OnCore] Procedure Alternatives Missing — Visit {visit_id}: {missed_cnt} missed"
-            body    = build_visit_email_html(
-                        g.sort_values(["visit_date", "clinical_procedure"]),
-                        since, until
-                     )
-
-            if dev_mode:
-                logger.info(f"(DEV) Sending test email for visit {visit_id} @ {mod_dt} ({missed_cnt} rows) to DEV_EMAIL")
-                send_email(to_email=(modifier or "dev-placeholder"),
-                           fromname=FROM_NAME, fromaddr=FROM_ADDR,
-                           subject=subject, body=body)
-            else:
-                logger.info(f"Sending email for visit {visit_id} @ {mod_dt} to {modifier} ({missed_cnt} rows)")
-                send_email(to_email=modifier,
-                           fromname=FROM_NAME, fromaddr=FROM_ADDR,
-                           subject=subject, body=body)
-
-            # Mark as sent & collect rows for the daily CSV
-            sent_keys.add(dedupe_key)
-            write_audit_event(
-                dev_mode=dev_mode,
-                event_type="INITIAL_ALERT",
-                visit_id=visit_id,
-                modified_user_email=modifier,
-                dedupe_key=dedupe_key,
-                job_run_id=job_run_id,
-            )
-            g_for_csv = g[["visit_date", "visit_name", "clinical_procedure"]].copy()
-            g_for_csv["visit_id"]    = visit_id
-            g_for_csv["modified_ts"] = mod_dt.isoformat(timespec="seconds")
-            g_for_csv["recipient"]   = modifier if not dev_mode else os.getenv("DEV_EMAIL")
-            g_for_csv["subject"]     = subject
-            g_for_csv["job_run_id"]  = job_run_id
-            sent_rows.append(g_for_csv)
+        audit_rows = []
+        try:
+            # One SMTP connection for the whole run instead of a reconnect per email
+            with smtp_session() as smtp:
+                for (visit_id, modifier, _), g in pending.groupby(group_cols, sort=False, dropna=False, observed=True):
+                    mod_iso = g["_mod_iso"].iat[0]
+                    dedupe_key = g["_dedupe_key"].iat[0]
+
+                    missed_cnt = len(g)
+                    subject = f"[OnCore] Procedure Alternatives Missing — Visit {visit_id}: {missed_cnt} missed"
+                    body    = build_visit_email_html(g, since, until)
+
+                    if dev_mode:
+                        logger.info(f"(DEV) Sending test email for visit {visit_id} @ {mod_iso} ({missed_cnt} rows) to DEV_EMAIL")
+                        recipient = modifier or "dev-placeholder"
+                    else:
+                        logger.info(f"Sending email for visit {visit_id} @ {mod_iso} to {modifier} ({missed_cnt} rows)")
+                        recipient = modifier
+                    send_email(to_email=recipient,
+                               fromname=FROM_NAME, fromaddr=FROM_ADDR,
+                               subject=subject, body=body, smtp=smtp)
+
+                    # Mark as sent & collect rows for the daily CSV
+                    sent_keys.add(dedupe_key)
+                    new_keys.append(dedupe_key)
+                    audit_rows.append(audit_event_params(
+                        event_type="INITIAL_ALERT",
+                        visit_id=visit_id,
+                        modified_user_email=modifier,
+                        dedupe_key=dedupe_key,
+                        job_run_id=job_run_id,
+                    ))
+                    sent_groups.append({
+                        "_dedupe_key": dedupe_key,
+                        "recipient": modifier if not dev_mode else os.getenv("DEV_EMAIL"),
+                        "subject": subject,
+                    })
+        finally:
+            # Audit rows for every email that went out, even if a later send failed
+            write_audit_events(dev_mode=dev_mode, rows=audit_rows)
 
         # Persist dedupe keys
-        save_sent_keys(s_path, sent_keys)
+        save_sent_keys(s_path, sent_keys, new_keys)
 
         # Write daily "sent notifications" CSV
-        if sent_rows:
-            sent_df = pd.concat(sent_rows, ignore_index=True)
+        if sent_groups:
+            sent_df = (
+                dfl[["visit_date", "visit_name", "clinical_procedure", "visit_id", "_mod_iso", "_dedupe_key"]]
+                .merge(pd.DataFrame(sent_groups), on="_dedupe_key")
+                .drop(columns="_dedupe_key")
+                .rename(columns={"_mod_iso": "modified_ts"})
+                .assign(job_run_id=job_run_id)
+            )
             csv_path = append_sent_records(
                 JOB_CODE, sent_df,
-                add_metadata={"environment": os.getenv("ENVIRONMENT")}
+                add_metadata={"environment": os.getenv("ENVIRONMENT")},
+                inplace=True
             )
             logger.info(f"Wrote sent notifications CSV: {csv_path}")
         else:
             logger.info("No notifications were sent in this run.")
 
         # --------- Advance watermark (capped at 'until') ---------
-        try:
-            max_seen = pd.to_datetime(df[COL_MODTS]).max().to_pydatetime()
-        except Exception:
-            try:
-                max_seen = pd.to_datetime(dfl["modified_date"]).max().to_pydatetime()
-            except Exception:
-                max_seen = until
-
-        new_mark = min(max_seen, until)
+        # modified_date was parsed to datetime64 during normalization, so this is a plain max.
+        max_seen = dfl["modified_date"].max()
+        new_mark = until if pd.isna(max_seen) else min(max_seen.to_pydatetime(), until)
         state["last_max_timestamp"] = new_mark.isoformat(timespec="seconds")
         save_state(s_path, state)
         logger.info(f"Advanced watermark to {state['last_max_timestamp']} (capped at 'until')")
@@ -6,6 +6,8 @@ Behavior:
 - One reminder email per (visit_id, modified_user_email).
 - Email body includes all currently unresolved clinical procedures for that grouping.
 - No modified_date windowing or watermark logic; this queries current unresolved rows each run.
+- Rows are streamed in (visit_id, modified_user_email) order and each grouping is emailed as soon as
+  all of its rows have arrived, so memory is bounded by the fetch batch rather than the full result.
 - Daily TXT log + daily CSV of sent reminders.
 - Failure alert email on exceptions.
 """
@@ -21,8 +23,9 @@ import pandas as pd
 
 from utils import (
     query_database,
+    query_database_chunks,
     execute_database,
-    send_email,
+    send_emails,
     init_daily_logger,
     append_sent_records,
     send_failure_alert,
@@ -52,10 +55,15 @@ FROM_ADDR = penv("ALERT_FROM_ADDR", "no-reply@yale.edu")
 
 LOG_DIR = os.getenv("LOG_DIR", "logs")
 REMINDER_INTERVAL_DAYS = int(penv("REMINDER_INTERVAL_DAYS", "7"))
+REMINDER_INTERVAL = pd.Timedelta(days=REMINDER_INTERVAL_DAYS)
 INITIAL_JOB_CODE = penv("INITIAL_JOB_CODE", "epay_no_procalt")
 AUDIT_TABLE = penv("AUDIT_TABLE", os.getenv("AUDIT_TABLE", "NOTIFICATION_AUDIT"))
 AUDIT_SCHEMA_PROD = penv("AUDIT_SCHEMA_PROD", os.getenv("AUDIT_SCHEMA_PROD"))
 AUDIT_SCHEMA_DEV = penv("AUDIT_SCHEMA_DEV", os.getenv("AUDIT_SCHEMA_DEV"))
+# IN-list lengths for the audit lookup (Oracle caps an IN list at 1000 expressions).
+# A batch is padded up to the smallest size that fits, so only these few statement
+# texts (and cached plans) ever exist and a small batch does not bind 1000 values.
+AUDIT_IN_LIST_SIZES = (10, 100, 1000)
 
 
 def build_sql() -> str:
@@ -70,26 +78,45 @@ def build_sql() -> str:
             {COL_VNAME}    AS visit_name,
             {COL_PROC}     AS clinical_procedure
         FROM {VIEW_FQN}
+        ORDER BY visit_id, modified_user_email, visit_date, clinical_procedure
     """
 
 def _audit_table_fqn(dev_mode: bool) -> str:
     schema = AUDIT_SCHEMA_DEV if dev_mode else AUDIT_SCHEMA_PROD
     return f"{schema}.{AUDIT_TABLE}" if schema else AUDIT_TABLE
 
-def _audit_history_sql(table_fqn: str) -> str:
+def _audit_history_sql(table_fqn: str, in_list_size: int) -> str:
+    # Filter on the raw VISIT_ID so IX_NOTIF_AUDIT_VISIT_USER drives the lookup; the
+    # normalized email is only grouped on here and matched in the pandas merge.
+    visit_binds = ", ".join(f":v{i}" for i in range(in_list_size))
     return f"""
         SELECT
-            TO_CHAR(VISIT_ID) AS visit_id,
+            VISIT_ID AS visit_id,
             LOWER(TRIM(MODIFIED_USER_EMAIL)) AS modified_user_email,
             MIN(CASE WHEN EVENT_TYPE = 'INITIAL_ALERT' THEN SENT_AT END) AS first_initial_sent_at,
             MAX(CASE WHEN EVENT_TYPE = 'WEEKLY_REMINDER' THEN SENT_AT END) AS last_weekly_sent_at
         FROM {table_fqn}
-        WHERE ENVIRONMENT = :environment
+        WHERE VISIT_ID IN ({visit_binds})
+          AND ENVIRONMENT = :environment
           AND JOB_CODE IN (:initial_job_code, :weekly_job_code)
-        GROUP BY TO_CHAR(VISIT_ID), LOWER(TRIM(MODIFIED_USER_EMAIL))
+        GROUP BY VISIT_ID, LOWER(TRIM(MODIFIED_USER_EMAIL))
     """
 
-def write_audit_event(*, dev_mode: bool, visit_id, modified_user_email: str, dedupe_key: str, job_run_id: str) -> None:
+def audit_event_params(*, visit_id, modified_user_email: str, dedupe_key: str, job_run_id: str) -> dict:
+    return {
+        "job_code": JOB_CODE,
+        "event_type": "WEEKLY_REMINDER",
+        "visit_id": str(visit_id) if visit_id is not None else None,
+        "modified_user_email": str(modified_user_email) if modified_user_email is not None else None,
+        "dedupe_key": dedupe_key,
+        "job_run_id": job_run_id,
+        "environment": os.getenv("ENVIRONMENT"),
+    }
+
+def write_audit_events(*, dev_mode: bool, rows: list) -> None:
+    """Insert all collected audit rows with one executemany() and a single commit."""
+    if not rows:
+        return
     table_fqn = _audit_table_fqn(dev_mode)
     sql = f"""
         INSERT INTO {table_fqn}
@@ -97,35 +124,32 @@ def write_audit_event(*, dev_mode: bool, visit_id, modified_user_email: str, ded
         VALUES
             (SYSTIMESTAMP, :job_code, :event_type, :visit_id, :modified_user_email, :dedupe_key, :job_run_id, :environment)
     """
-    execute_database(
-        sql_query=sql,
-        db_type="oracle",
-        params={
-            "job_code": JOB_CODE,
-            "event_type": "WEEKLY_REMINDER",
-            "visit_id": str(visit_id) if visit_id is not None else None,
-            "modified_user_email": str(modified_user_email) if modified_user_email is not None else None,
-            "dedupe_key": dedupe_key,
-            "job_run_id": job_run_id,
-            "environment": os.getenv("ENVIRONMENT"),
-        },
-    )
+    execute_database(sql_query=sql, db_type="oracle", params=rows)
 
 
 def _fmt_date(val) -> str:
-    try:
-        return pd.to_datetime(val).strftime("%Y-%m-%d")
-    except Exception:
-        return str(val or "")
+    if val is None or val != val:
+        return ""
+    return val.strftime("%Y-%m-%d") if hasattr(val, "strftime") else str(val)
+
+
+def _s(value):
+    """Blank for missing values; a plain None/NaN check is far cheaper than scalar pd.isna."""
+    return "" if value is None or value != value else value
+
+
+def _fmt_dates(values: pd.Series) -> pd.Series:
+    """Format a whole date column in one vectorized pass; unparseable values become ''."""
+    return pd.to_datetime(values, errors="coerce").dt.strftime("%Y-%m-%d").fillna("")
 
 
 def _section_intro(modified_user_name, protocol_no, subject_name, visit_date, missed_count) -> str:
     return f"""
-      <p>Dear {'' if pd.isna(modified_user_name) else modified_user_name},</p>
+      <p>Dear {_s(modified_user_name)},</p>
       <p><strong>Reminder:</strong> The visit below still includes unresolved ePayment procedure alternatives.</p>
       <p>
-        <strong>Protocol:</strong> {'' if pd.isna(protocol_no) else protocol_no}<br/>
-        <strong>Subject:</strong> {'' if pd.isna(subject_name) else subject_name}<br/>
+        <strong>Protocol:</strong> {_s(protocol_no)}<br/>
+        <strong>Subject:</strong> {_s(subject_name)}<br/>
         <strong>Visit Date:</strong> {_fmt_date(visit_date)}<br/>
         <strong>Missed Procedures (count):</strong> {missed_count}
       </p>
@@ -144,13 +168,17 @@ def _action_section() -> str:
     """
 
 
-def _section_table(rows_df: pd.DataFrame) -> str:
-    body_rows = "\n".join(
-        f"<tr><td>{_fmt_date(r['visit_date'])}</td>"
-        f"<td>{r.get('visit_name','')}</td>"
-        f"<td>{r.get('clinical_procedure','')}</td></tr>"
-        for _, r in rows_df.iterrows()
+def _table_rows_html(rows_df: pd.DataFrame) -> pd.Series:
+    """One <tr> string per row, built with vectorized string concatenation over the whole frame."""
+    return (
+        "<tr><td>" + _fmt_dates(rows_df["visit_date"])
+        + "</td><td>" + rows_df["visit_name"].fillna("").astype(str)
+        + "</td><td>" + rows_df["clinical_procedure"].fillna("").astype(str)
+        + "</td></tr>"
     )
+
+
+def _section_table(body_rows: str) -> str:
     return (
         "<table style='border-collapse:collapse' border='1' cellpadding='6'>"
         "<thead><tr><th>VISIT_DATE</th><th>VISIT_NAME</th><th>CLINICAL_PROCEDURE</th></tr></thead>"
@@ -158,17 +186,16 @@ def _section_table(rows_df: pd.DataFrame) -> str:
     )
 
 
-def build_visit_email_html(g: pd.DataFrame) -> str:
-    g = g.rename(columns=str.lower).copy().sort_values(["visit_date", "clinical_procedure"])
-    last_row = g.iloc[-1]
+def build_visit_email_html(meta) -> str:
+    """meta is the group's row from the per-group aggregate, including its joined table rows."""
     intro_html = _section_intro(
-        last_row.get("modified_user_name"),
-        last_row.get("protocol_no"),
-        last_row.get("subject_name"),
-        last_row.get("visit_date"),
-        len(g),
+        meta.modified_user_name,
+        meta.protocol_no,
+        meta.subject_name,
+        meta.visit_date,
+        meta.missed_count,
     )
-    table_html = _section_table(g[["visit_date", "visit_name", "clinical_procedure"]])
+    table_html = _section_table(meta.rows_html)
     action_html = _action_section()
     footer = (
         "<p style='color:#6a737d'>This reminder was generated automatically. "
@@ -177,6 +204,135 @@ def build_visit_email_html(g: pd.DataFrame) -> str:
     return f"<div style='font-family:Segoe UI,Arial,sans-serif;font-size:13px'>{intro_html}{table_html}{action_html}{footer}</div>"
 
 
+def _load_audit_history(dev_mode: bool, rows: pd.DataFrame) -> pd.DataFrame:
+    """
+    Earliest INITIAL_ALERT and latest WEEKLY_REMINDER per (visit, normalized user) for
+    the visits present in rows. Visits are looked up at most 1000 per query; pairs for
+    users not in rows are dropped by the caller's merge.
+    """
+    table_fqn = _audit_table_fqn(dev_mode)
+    visits = rows["_k_visit"].unique().tolist()
+    max_size = AUDIT_IN_LIST_SIZES[-1]
+    frames = []
+    for start in range(0, len(visits), max_size):
+        chunk = visits[start:start + max_size]
+        size = next(n for n in AUDIT_IN_LIST_SIZES if n >= len(chunk))
+        chunk += [chunk[-1]] * (size - len(chunk))
+        params = {
+            "environment": os.getenv("ENVIRONMENT"),
+            "initial_job_code": INITIAL_JOB_CODE,
+            "weekly_job_code": JOB_CODE,
+        }
+        params.update((f"v{i}", visit_key) for i, visit_key in enumerate(chunk))
+        frames.append(query_database(sql_query=_audit_history_sql(table_fqn, size), db_type="oracle", params=params))
+    if not frames:
+        return pd.DataFrame(columns=["_k_visit", "_k_user", "first_initial_sent_at", "last_weekly_sent_at"])
+    hist_df = pd.concat(frames, ignore_index=True).rename(columns=str.lower)
+    hist_df = hist_df.assign(
+        _k_visit=hist_df["visit_id"].astype(str),
+        _k_user=hist_df["modified_user_email"].fillna("").astype(str).str.strip().str.lower(),
+        first_initial_sent_at=pd.to_datetime(hist_df["first_initial_sent_at"], errors="coerce"),
+        last_weekly_sent_at=pd.to_datetime(hist_df["last_weekly_sent_at"], errors="coerce"),
+    )[["_k_visit", "_k_user", "first_initial_sent_at", "last_weekly_sent_at"]]
+    return hist_df.drop_duplicates(["_k_visit", "_k_user"], keep="last")
+
+
+def _send_reminders(dfl: pd.DataFrame, hist_df: pd.DataFrame, *, now_ts, dev_mode: bool, job_run_id: str,
+                    audit_rows: list, logger) -> list:
+    """
+    Email every eligible (visit_id, modified_user_email) grouping in dfl. dfl must hold
+    complete groups and carry the normalized _k_visit/_k_user join keys.
+    Appends one audit row per sent email to audit_rows and returns the per-group
+    frames for the sent-records CSV.
+    """
+    # Left merge keeps dfl's row order, so groups stay sorted for the email tables.
+    dfl = dfl.merge(hist_df, on=["_k_visit", "_k_user"], how="left")
+
+    sent_rows = []
+    # Anything sent after the cutoff is still inside the reminder interval (NaT compares False)
+    cutoff = now_ts - REMINDER_INTERVAL
+    group_cols = ["visit_id", "modified_user_email"]
+
+    # Decide eligibility for every row up front so ineligible (visit, user) pairs
+    # never reach the per-group email loop. Rules are applied in order and each
+    # skipped pair is logged once with the first rule that excluded it.
+    first_initial = dfl["first_initial_sent_at"]
+    last_weekly = dfl["last_weekly_sent_at"]
+    no_modifier = (dfl["_k_user"] == "") & (not dev_mode)
+    for visit_id in dfl.loc[no_modifier, "visit_id"].unique():
+        logger.warning(f"Skipping visit {visit_id}: empty MODIFIED_USER_EMAIL")
+    skipped = no_modifier
+    for mask, reason in (
+        (first_initial.isna(), "no INITIAL_ALERT found in audit table"),
+        (first_initial > cutoff, f"INITIAL_ALERT is newer than {REMINDER_INTERVAL_DAYS} days"),
+        (last_weekly > cutoff, f"last weekly reminder is newer than {REMINDER_INTERVAL_DAYS} days"),
+    ):
+        mask = mask & ~skipped
+        for visit_id, modifier in dfl.loc[mask, group_cols].drop_duplicates().itertuples(index=False):
+            logger.info(f"Skipping weekly reminder for visit {visit_id} / {modifier}: {reason}")
+        skipped = skipped | mask
+    # Categorical keys: factorized once, so the groupby below works on integer codes.
+    # A missing modifier (dev only) becomes "" so no group key is NaN.
+    pending = dfl[~skipped].assign(modified_user_email=lambda d: d["modified_user_email"].fillna(""))
+    pending = pending.astype({"visit_id": "category", "modified_user_email": "category"})
+
+    pending["_row_html"] = _table_rows_html(pending)
+    jobs = []
+    grouped = pending.groupby(group_cols, dropna=False, sort=False, observed=True)
+    # Header fields for every group in one aggregation; rows are sorted by visit_date
+    # within each group, and the name fields come from the group's last row (iloc[-1],
+    # not "last", which would skip nulls and could mix values from different rows).
+    meta = grouped.agg(
+        modified_user_name=("modified_user_name", lambda s: s.iloc[-1]),
+        protocol_no=("protocol_no", lambda s: s.iloc[-1]),
+        subject_name=("subject_name", lambda s: s.iloc[-1]),
+        visit_date=("visit_date", "max"),
+        missed_count=("clinical_procedure", "size"),
+        rows_html=("_row_html", "\n".join),
+    )
+    # Each email's recipient, header and rows all come from the same meta row, keyed
+    # by its (visit_id, modifier) index entry; the CSV rows are looked up by that key too
+    for (visit_id, modifier), group_meta in zip(meta.index, meta.itertuples(index=False)):
+        missed_cnt = group_meta.missed_count
+        subject = f"[OnCore Reminder] Procedure Alternatives Still Missing — Visit {visit_id}: {missed_cnt} missed"
+        body = build_visit_email_html(group_meta)
+        dedupe_key = f"{visit_id}|{modifier}|{now_ts.strftime('%Y-%m-%d')}"
+
+        if dev_mode:
+            logger.info(f"(DEV) Sending weekly reminder for visit {visit_id} ({missed_cnt} rows) to DEV_EMAIL")
+            recipient = modifier or "dev-placeholder"
+        else:
+            logger.info(f"Sending weekly reminder for visit {visit_id} to {modifier} ({missed_cnt} rows)")
+            recipient = modifier
+        tag = (visit_id, modifier, dedupe_key, subject)
+        jobs.append((tag, dict(to_email=recipient, fromname=FROM_NAME, fromaddr=FROM_ADDR, subject=subject, body=body)))
+
+    # Sends run concurrently; audit and CSV rows are recorded only for the ones that went out
+    first_error = None
+    for (visit_id, modifier, dedupe_key, subject), error in send_emails(jobs):
+        if error is not None:
+            logger.error(f"Failed to send weekly reminder for visit {visit_id} to {modifier}: {error}")
+            first_error = first_error or error
+            continue
+        audit_rows.append(audit_event_params(
+            visit_id=visit_id,
+            modified_user_email=modifier,
+            dedupe_key=dedupe_key,
+            job_run_id=job_run_id,
+        ))
+
+        g_for_csv = grouped.get_group((visit_id, modifier))[["visit_date", "visit_name", "clinical_procedure"]].copy()
+        g_for_csv["visit_id"] = visit_id
+        g_for_csv["recipient"] = modifier if not dev_mode else os.getenv("DEV_EMAIL")
+        g_for_csv["subject"] = subject
+        g_for_csv["job_run_id"] = job_run_id
+        sent_rows.append(g_for_csv)
+
+    if first_error is not None:
+        raise first_error
+    return sent_rows
+
+
 def main(argv=None):
     parser = argparse.ArgumentParser(description="OnCore ProcAlt weekly reminder notifier")
     parser.add_argument("--dev", action="store_true", help="Run in dev mode (routes email to DEV_EMAIL)")
@@ -206,104 +362,51 @@ def main(argv=None):
     try:
         sql = build_sql()
         logger.info("Querying Oracle for unresolved weekly reminder records…")
-        df = query_database(sql_query=sql, db_type="oracle")
-        logger.info(f"Query complete. Rows returned: {0 if df is None else len(df)}")
-
-        if df is None or df.empty:
-            logger.info("No rows found. Job completed successfully (no reminders).")
-            return
-
-        dfl = df.rename(columns=str.lower).copy()
-        table_fqn = _audit_table_fqn(dev_mode)
-        hist_df = query_database(
-            sql_query=_audit_history_sql(table_fqn),
-            db_type="oracle",
-            params={
-                "environment": os.getenv("ENVIRONMENT"),
-                "initial_job_code": INITIAL_JOB_CODE,
-                "weekly_job_code": JOB_CODE,
-            },
-        ).rename(columns=str.lower)
-        history_by_key = {}
-        for _, r in hist_df.iterrows():
-            key = (str(r.get("visit_id")), str(r.get("modified_user_email") or "").strip().lower())
-            history_by_key[key] = {
-                "first_initial_sent_at": pd.to_datetime(r.get("first_initial_sent_at"), errors="coerce"),
-                "last_weekly_sent_at": pd.to_datetime(r.get("last_weekly_sent_at"), errors="coerce"),
-            }
-
-        sent_rows = []
         now_ts = pd.Timestamp.now()
-
-        group_cols = ["visit_id", "modified_user_email"]
-        for (visit_id, modifier), g in dfl.groupby(group_cols, dropna=False):
-            if not modifier and not dev_mode:
-                logger.warning(f"Skipping visit {visit_id}: empty MODIFIED_USER_EMAIL")
-                continue
-            key = (str(visit_id), str(modifier or "").strip().lower())
-            hist = history_by_key.get(key)
-            if not hist or pd.isna(hist["first_initial_sent_at"]):
-                logger.info(f"Skipping weekly reminder for visit {visit_id} / {modifier}: no INITIAL_ALERT found in audit table")
-                continue
-
-            first_initial = hist["first_initial_sent_at"]
-            if now_ts < first_initial + pd.Timedelta(days=REMINDER_INTERVAL_DAYS):
-                logger.info(
-                    f"Skipping weekly reminder for visit {visit_id} / {modifier}: "
-                    f"INITIAL_ALERT is newer than {REMINDER_INTERVAL_DAYS} days"
-                )
-                continue
-
-            last_weekly = hist["last_weekly_sent_at"]
-            if not pd.isna(last_weekly) and now_ts < last_weekly + pd.Timedelta(days=REMINDER_INTERVAL_DAYS):
-                logger.info(
-                    f"Skipping weekly reminder for visit {visit_id} / {modifier}: "
-                    f"last weekly reminder is newer than {REMINDER_INTERVAL_DAYS} days"
-                )
-                continue
-
-            missed_cnt = len(g)
-            subject = f"[OnCore Reminder] Procedure Alternatives Still Missing — Visit {visit_id}: {missed_cnt} missed"
-            body = build_visit_email_html(g.sort_values(["visit_date", "clinical_procedure"]))
-            dedupe_key = f"{visit_id}|{modifier}|{now_ts.strftime('%Y-%m-%d')}"
-
-            if dev_mode:
-                logger.info(f"(DEV) Sending weekly reminder for visit {visit_id} ({missed_cnt} rows) to DEV_EMAIL")
-                send_email(
-                    to_email=(modifier or "dev-placeholder"),
-                    fromname=FROM_NAME,
-                    fromaddr=FROM_ADDR,
-                    subject=subject,
-                    body=body,
-                )
-            else:
-                logger.info(f"Sending weekly reminder for visit {visit_id} to {modifier} ({missed_cnt} rows)")
-                send_email(
-                    to_email=modifier,
-                    fromname=FROM_NAME,
-                    fromaddr=FROM_ADDR,
-                    subject=subject,
-                    body=body,
-                )
-            write_audit_event(
-                dev_mode=dev_mode,
-                visit_id=visit_id,
-                modified_user_email=modifier,
-                dedupe_key=dedupe_key,
-                job_run_id=job_run_id,
+        carry = None
+        row_count = 0
+        sent_rows = []
+        audit_rows = []
+        # Audit rows are written in one batch; the finally makes sure every email that
+        # did go out is recorded even if a later send fails.
+        try:
+            for chunk in query_database_chunks(sql_query=sql, db_type="oracle"):
+                row_count += len(chunk)
+                dfl = chunk.rename(columns=str.lower)
+                dfl["_k_visit"] = dfl["visit_id"].astype(str)
+                dfl["_k_user"] = dfl["modified_user_email"].fillna("").astype(str).str.strip().str.lower()
+                if carry is not None:
+                    dfl = pd.concat([carry, dfl], ignore_index=True)
+                # The SQL is ordered by (visit, user), so only the last key can continue into
+                # the next batch; hold its rows back until that key changes.
+                last = dfl.iloc[-1]
+                tail = (dfl["_k_visit"] == last["_k_visit"]) & (dfl["_k_user"] == last["_k_user"])
+                carry = dfl[tail]
+                ready = dfl[~tail]
+                if not ready.empty:
+                    sent_rows += _send_reminders(
+                        ready, _load_audit_history(dev_mode, ready),
+                        now_ts=now_ts, dev_mode=dev_mode, job_run_id=job_run_id,
+                        audit_rows=audit_rows, logger=logger
+                    )
+            logger.info(f"Query complete. Rows returned: {row_count}")
+
+            if row_count == 0:
+                logger.info("No rows found. Job completed successfully (no reminders).")
+                return
+            sent_rows += _send_reminders(
+                carry, _load_audit_history(dev_mode, carry),
+                now_ts=now_ts, dev_mode=dev_mode, job_run_id=job_run_id,
+                audit_rows=audit_rows, logger=logger
             )
-
-            g_for_csv = g[["visit_date", "visit_name", "clinical_procedure"]].copy()
-            g_for_csv["visit_id"] = visit_id
-            g_for_csv["recipient"] = modifier if not dev_mode else os.getenv("DEV_EMAIL")
-            g_for_csv["subject"] = subject
-            g_for_csv["job_run_id"] = job_run_id
-            sent_rows.append(g_for_csv)
+        finally:
+            write_audit_events(dev_mode=dev_mode, rows=audit_rows)
 
         if sent_rows:
             sent_df = pd.concat(sent_rows, ignore_index=True)
             csv_path = append_sent_records(
-                JOB_CODE, sent_df, add_metadata={"environment": os.getenv("ENVIRONMENT")}
+                JOB_CODE, sent_df, add_metadata={"environment": os.getenv("ENVIRONMENT")},
+                inplace=True
             )
             logger.info(f"Wrote sent reminders CSV: {csv_path}")
         else:
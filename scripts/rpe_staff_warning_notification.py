@@ -1,7 +1,5 @@
-from utils import query_database, save_to_csv, send_email
-import pandas as pd
-from email.mime.base import MIMEBase
-import io
+from utils import excel_attachment, query_database, save_to_csv, send_emails, table_html
+import os
 
 # Variables that can be updated for each notification script
 sql_query = "select * from oncore_report_ro.get_latest_rpe_staff_warnings"
@@ -29,37 +27,34 @@ def main():
     df = query_database(sql_query)
     save_to_csv(df)
 
-    df[f'{url_field}_HTML'] = df[url_field].apply(lambda x: f'<a href="{x}">link</a>')
-    grouped_df = df.groupby(to_email)
-    sent_mail = []
+    fromname = os.getenv('EMAIL_FROM_NAME', 'no-reply.YCCI')
+    fromaddr = os.getenv('EMAIL_FROM_ADDRESS', 'no-reply.ycci@yale.edu')
+    subject = f"OnCore Notification: {notification_name}"
+    # Split the template once; each email only concatenates its own table in between
+    body_head, body_tail = email_body_template.split('{TABLE}')
+    table_style = "<style>th { text-align: left; }</style>"
+    attachment_filename = f"{notification_name.replace(' ', '_').lower()}.xlsx"
 
-    for email, group in grouped_df:
-        if email in sent_mail:
-            pass
+    jobs = []
+    # groupby yields each recipient exactly once, so no separate dedupe is needed
+    for email, group in df.groupby(to_email, sort=False):
+        email_table = group.sort_values(by=['PROTOCOL_NO', 'SEQUENCE_NUMBER'])[email_table_columns]
+        if len(email_table) > 20:
+            attachment = excel_attachment(email_table, url_field)
+            email_body = body_head + body_tail
+            filename = attachment_filename
         else:
-            sent_mail.append(email)
-            email_table = group[email_table_columns].sort_values(by=['PROTOCOL_NO', 'SEQUENCE_NUMBER'])
-            if len(email_table) > 20:
-                excel_buffer = io.BytesIO()
-                with pd.ExcelWriter(excel_buffer, engine='xlsxwriter') as writer:
-                    email_table.to_excel(writer, index=False, sheet_name='Sheet1')
-                    workbook = writer.book
-                    worksheet = writer.sheets['Sheet1']
-                    for idx, url in enumerate(email_table[url_field], start=1):
-                        worksheet.write_url(f'E{idx+2}', url, string='link')
-                    excel_buffer.seek(0)
-                attachment = MIMEBase('application', 'vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-                attachment.set_payload(excel_buffer.read())
-                email_body = email_body_template.replace('{TABLE}', '')
-                filename = f"{notification_name.replace(' ', '_').lower()}.xlsx"
-            else:
-                html_table = email_table.to_html(index=False, render_links=True, escape=False)
-                html_table = f"<style>th {{ text-align: left; }}</style>{html_table}"
-                email_body = email_body_template.format(TABLE=html_table)
-                attachment = None
-                filename = None
+            email_body = body_head + table_style + table_html(email_table, url_field) + body_tail
+            attachment = None
+            filename = None
 
-        send_email(email, f"OnCore Notification: {notification_name}", email_body, filename, attachment)
+        jobs.append((email, dict(to_email=email, fromname=fromname, fromaddr=fromaddr, subject=subject,
+                                 body=email_body, filename=filename, attachment=attachment)))
+
+    # Bodies are built serially above; the SMTP sends fan out over a small pool
+    for email, error in send_emails(jobs):
+        if error is not None:
+            raise error
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,12 +1,11 @@
-from utils import query_database, save_to_csv, send_email
+from utils import query_database, save_to_csv, send_emails
 import pandas as pd
-from email.mime.base import MIMEBase
-import io
 import os
 import logging
 from datetime import datetime
 import sys
 import re
+import functools
 from typing import List
 
 # Create logs directory if it doesn't exist
@@ -69,7 +68,24 @@ For any questions about the status of your project(s), please reach out to the a
 </html>
 '''
 
-EMAIL_REGEX = re.compile(r"^[A-Za-z0-9._%+\-]+@[A-Za-z0-9.\-]+\.[A-Za-z]{2,}$")
+# ASCII-only matching, anchored with \A...\Z for whole-string validation.
+EMAIL_REGEX = re.compile(r"\A[A-Za-z0-9._%+\-]+@[A-Za-z0-9.\-]+\.[A-Za-z]{2,}\Z", re.ASCII)
+
+@functools.lru_cache(maxsize=8)
+def _load_leadership_emails(email_csv_path: str, mtime: float) -> frozenset:
+    """
+    Valid leadership addresses from email_list.csv (columns: email, type).
+    Cached per (path, mtime), so the CSV is only re-parsed after it changes.
+    """
+    email_df = pd.read_csv(email_csv_path)
+    leadership_emails = (
+        email_df[email_df['type'].str.lower() == 'leadership']['email']
+        .dropna()
+        .astype(str)
+        .str.strip()
+        .str.lower()
+    )
+    return frozenset(addr for addr in leadership_emails if EMAIL_REGEX.match(addr))
 
 def get_email_list(activation_df: pd.DataFrame, email_csv_path: str = 'email_list.csv') -> List[str]:
     """
@@ -80,7 +96,8 @@ def get_email_list(activation_df: pd.DataFrame, email_csv_path: str = 'email_lis
 
     Notes:
     - No 'standard' filtering from CSV; that requirement is removed.
-    - Handles multiple addresses separated by commas/semicolons/whitespace.
+    - Handles multiple addresses separated by commas/semicolons/whitespace
+      by extracting every address match from the cell text.
     """
     email_fields = [
         'pi_contact_email',
@@ -92,39 +109,26 @@ def get_email_list(activation_df: pd.DataFrame, email_csv_path: str = 'email_lis
     recipients: set[str] = set()
 
     # 1) Collect emails from DataFrame
+    present = []
     for field in email_fields:
         if field not in activation_df.columns:
             logging.warning(f"Expected email field '{field}' not found in DataFrame.")
             continue
+        present.append(activation_df[field])
 
-        series = (
-            activation_df[field]
-            .dropna()
-            .astype(str)
-            .str.replace(r'[\r\n]+', ' ', regex=True)
-            .str.split(r'[;, ]+')  # split on semicolons, commas, or whitespace
-        )
-
-        for parts in series:
-            for addr in parts:
-                addr = addr.strip().lower()
-                if addr and EMAIL_REGEX.match(addr):
-                    recipients.add(addr)
+    if present:
+        # Split every email column into tokens on commas/semicolons/whitespace in one
+        # vectorized pass; only tokens that are a valid address as a whole are kept,
+        # so no part of a malformed entry is ever mailed.
+        values = pd.concat(present, ignore_index=True).dropna().astype(str).str.lower()
+        tokens = values.str.split(r"[;,\s]+", regex=True).explode()
+        valid = tokens.str.match(EMAIL_REGEX.pattern, flags=EMAIL_REGEX.flags).fillna(False).astype(bool)
+        recipients.update(tokens[valid].unique())
 
     # 2) Add leadership emails from CSV (if available)
     try:
-        email_df = pd.read_csv(email_csv_path)  # Columns: email, type
-        leadership_emails = (
-            email_df[email_df['type'].str.lower() == 'leadership']['email']
-            .dropna()
-            .astype(str)
-            .str.strip()
-            .str.lower()
-            .tolist()
-        )
-        for addr in leadership_emails:
-            if EMAIL_REGEX.match(addr):
-                recipients.add(addr)
+        leadership_emails = _load_leadership_emails(email_csv_path, os.path.getmtime(email_csv_path))
+        recipients.update(leadership_emails)
         logging.info(f"Loaded {len(leadership_emails)} leadership emails from {email_csv_path}.")
     except Exception as e:
         logging.warning(f"Could not load leadership emails from {email_csv_path}: {e}")
@@ -151,20 +155,17 @@ def main():
     fromaddr = os.getenv('EMAIL_FROM_ADDRESS', 'no-reply.ycci@yale.edu')
     email_body = email_body_template
 
-    sent_mail = []
-
-    for email in email_list:
-        if email in sent_mail:
-            continue
-        try:
-            send_email(email,fromname, fromaddr, notification_name, email_body,)
+    # email_list is already de-duplicated, so each address gets exactly one job
+    jobs = [
+        (email, dict(to_email=email, fromname=fromname, fromaddr=fromaddr,
+                     subject=notification_name, body=email_body))
+        for email in email_list
+    ]
+    for email, error in send_emails(jobs):
+        if error is None:
             logging.info(f"Email sent to {email}")
-            sent_mail.append(email)        
-        except Exception as e:
-            logging.error(f"Failed to send email to {email}: {e}")
-
-
-        
+        else:
+            logging.error(f"Failed to send email to {email}: {error}")
 
 if __name__ == "__main__":
     main()
@@ -1,14 +1,14 @@
-from utils import query_database, save_to_csv, send_email
+from utils import excel_attachment, query_database, save_to_csv, send_emails, table_html
 import pandas as pd
-from email.mime.base import MIMEBase
-import io
+import os
+from concurrent.futures import ThreadPoolExecutor
 
 # Variables that can be updated for each notification script
 sql_query = "select * from oncore_report_ro.ycci_visit_tracking where unacknowledged_visit_outside_policy = 'yes'"
 to_email = 'COORDINATOR_EMAIL'
 notification_name = "Unacknowledged Visits Report"
 url_field = "CRA_CONSOLE_VISIT_URL"
-email_table_columns = ["PROTOCOL_NO", "SEQUENCE_NUMBER", "SEGMENT_NAME", "VISIT_NAME", f'{url_field}_HTML']
+email_table_columns = ["PROTOCOL_NO", "SEQUENCE_NUMBER", "SEGMENT_NAME", "VISIT_NAME", url_field]
 
 email_body_template = '''\
         <html>
@@ -26,41 +26,53 @@ email_body_template = '''\
         </html>
         '''
 
-def main():
-    df = query_database(sql_query)
-    save_to_csv(df)
+# Split the template around {TABLE} once; each email is just head + table + tail
+_BODY_HEAD, _BODY_TAIL = email_body_template.split('{TABLE}')
+_EXCEL_BODY = _BODY_HEAD + _BODY_TAIL
+_EXCEL_FILENAME = f"{notification_name.replace(' ', '_').lower()}.xlsx"
 
-    df[f'{url_field}_HTML'] = df[url_field].apply(lambda x: f'<a href="{x}">link</a>')
-    grouped_df = df.groupby(to_email)
-    sent_mail = []
+def _send_reports(df: pd.DataFrame) -> None:
+    fromname = os.getenv('EMAIL_FROM_NAME', 'no-reply.YCCI')
+    fromaddr = os.getenv('EMAIL_FROM_ADDRESS', 'no-reply.ycci@yale.edu')
+    subject = f"OnCore Notification: {notification_name}"
 
-    for email, group in grouped_df:
-        if email in sent_mail:
-            pass
+    # Project and sort once up front; groupby(sort=False) keeps this order, so every
+    # group is already ordered by protocol and sequence number, and selecting the
+    # table columns on the groupby hands back per-group frames without the key column
+    view = df[[to_email] + email_table_columns].sort_values(by=[to_email, 'PROTOCOL_NO', 'SEQUENCE_NUMBER'])
+    grouped_df = view.groupby(to_email, sort=False)[email_table_columns]
+
+    jobs = []
+    # groupby yields each recipient exactly once, so no separate dedupe is needed
+    for email, email_table in grouped_df:
+        if len(email_table) > 20:
+            email_body = _EXCEL_BODY
+            filename = _EXCEL_FILENAME
+            attachment = excel_attachment(email_table, url_field)
         else:
-            sent_mail.append(email)
-            email_table = group[email_table_columns].sort_values(by=['PROTOCOL_NO', 'SEQUENCE_NUMBER'])
-            if len(email_table) > 20:
-                excel_buffer = io.BytesIO()
-                with pd.ExcelWriter(excel_buffer, engine='xlsxwriter') as writer:
-                    email_table.to_excel(writer, index=False, sheet_name='Sheet1')
-                    workbook = writer.book
-                    worksheet = writer.sheets['Sheet1']
-                    for idx, url in enumerate(email_table[url_field], start=1):
-                        worksheet.write_url(f'E{idx+2}', url, string='link')
-                    excel_buffer.seek(0)
-                attachment = MIMEBase('application', 'vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-                attachment.set_payload(excel_buffer.read())
-                email_body = email_body_template.replace('{TABLE}', '')
-                filename = f"{notification_name.replace(' ', '_').lower()}.xlsx"
-            else:
-                html_table = email_table.to_html(index=False, render_links=True, escape=False)
-                html_table = f"<style>th {{ text-align: left; }}</style>{html_table}"
-                email_body = email_body_template.format(TABLE=html_table)
-                attachment = None
-                filename = None
+            email_body = _BODY_HEAD + "<style>th { text-align: left; }</style>" + table_html(email_table, url_field) + _BODY_TAIL
+            attachment = None
+            filename = None
+
+        jobs.append((email, dict(to_email=email, fromname=fromname, fromaddr=fromaddr, subject=subject,
+                                 body=email_body, filename=filename, attachment=attachment)))
+
+    # Bodies are built serially above; the SMTP sends fan out over a small pool
+    for email, error in send_emails(jobs):
+        if error is not None:
+            raise error
+
+def main():
+    df = query_database(sql_query)
+    if df.empty:
+        return
 
-        send_email(email, f"OnCore Notification: {notification_name}", email_body, filename, attachment)
+    # The snapshot CSV is independent of the emails; write it on a side thread so
+    # building and sending does not wait behind it. result() re-raises a failed write.
+    with ThreadPoolExecutor(max_workers=1) as csv_pool:
+        csv_write = csv_pool.submit(save_to_csv, df)
+        _send_reports(df)
+        csv_write.result()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -2,21 +2,28 @@ import oracledb
 import pandas as pd
 import os, sys
 import smtplib
-import sys
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
+from email.message import EmailMessage
+from email import policy
 from email.mime.base import MIMEBase
-from email import encoders
 from dotenv import load_dotenv
 from datetime import datetime
-import io
 import csv
+import dns.exception
 import dns.resolver
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+import time
 
 import logging
+import logging.handlers
 from logging import Logger
 from pathlib import Path
 
+import atexit
+import html
+import queue
+from string import Template
 import traceback
 import uuid
 
@@ -63,6 +70,16 @@ for candidate in _candidate_env_paths():
 if not _loaded:
     load_dotenv()  # will no-op if no .env in CWD
 
+# Upper bound on concurrent SMTP connections used by send_emails().
+EMAIL_POOL_SIZE = int(os.getenv('EMAIL_POOL_SIZE', '8'))
+
+# Rows fetched per Oracle round-trip. The driver default (100) makes larger pulls
+# chatty over the network; prefetchrows is kept one above so the first fetch
+# also covers the final "no more rows" check.
+ORACLE_ARRAYSIZE = int(os.getenv('ORACLE_ARRAYSIZE', '10000'))
+# psycopg's cursor.arraysize defaults to 1, so Postgres fetches pass a batch size explicitly.
+POSTGRES_FETCH_SIZE = int(os.getenv('POSTGRES_FETCH_SIZE', '10000'))
+
 def _choose_env(prefix: str, name: str, fallback_env_names=None):
     """
     Helper to choose an env var with optional fallbacks.
@@ -131,98 +148,331 @@ def get_db_credentials(db_type='oracle'):
     else:
         raise ValueError("Unsupported database type")
 
-def query_database(sql_query, db_type='oracle', params=None):
-    creds = get_db_credentials(db_type)
+# One Oracle session pool per process, created on first use so it picks up the
+# credentials for whatever ENVIRONMENT the script has set by then.
+ORACLE_POOL_MIN = int(os.getenv('ORACLE_POOL_MIN', '2'))
+ORACLE_POOL_MAX = int(os.getenv('ORACLE_POOL_MAX', '10'))
+# Per-connection statement cache; pooled connections reuse parsed cursors for
+# repeated (bind-variable) SQL instead of soft-parsing it again.
+ORACLE_STMT_CACHE = int(os.getenv('ORACLE_STMT_CACHE', '50'))
+_ORACLE_POOL = None
+
+def _get_oracle_pool():
+    global _ORACLE_POOL
+    if _ORACLE_POOL is None:
+        creds = get_db_credentials('oracle')
+        _ORACLE_POOL = oracledb.create_pool(
+            user=creds['user'], password=creds['password'], dsn=creds['dsn'],
+            min=ORACLE_POOL_MIN, max=ORACLE_POOL_MAX, increment=1,
+            getmode=oracledb.POOL_GETMODE_WAIT, stmtcachesize=ORACLE_STMT_CACHE,
+        )
+    return _ORACLE_POOL
 
+def _columns_to_frame(columns, col_names):
+    """
+    Build a DataFrame from one sequence per column. Keyed by position so duplicate
+    column names survive; pandas infers each column's dtype once over all its values.
+    """
+    df = pd.DataFrame(dict(enumerate(columns)), columns=range(len(col_names)))
+    df.columns = col_names
+    return df
+
+def _rows_to_frame(rows, col_names):
+    """
+    Build a DataFrame from a list of row tuples. zip(*rows) transposes to columns
+    in C, so pandas gets one sequence per column instead of splitting every row.
+    """
+    return _columns_to_frame(zip(*rows), col_names)
+
+def _iter_frames(cursor, col_names, chunk_size=None):
+    """Yield one DataFrame per fetchmany() batch from an executed cursor."""
+    while True:
+        rows = cursor.fetchmany(chunk_size or cursor.arraysize)
+        if not rows:
+            break
+        yield _rows_to_frame(rows, col_names)
+
+def _fetch_dataframe(cursor, col_names, chunk_size=None):
+    """
+    Build a DataFrame from an executed cursor one fetchmany() batch at a time. Each
+    batch is appended to per-column lists, so the full result is never held as a list
+    of row tuples, and the frame is built once at the end: dtypes are inferred over the
+    whole column, not per batch (a batch that is all NULL in a column cannot upcast it).
+    """
+    columns = [[] for _ in col_names]
+    while True:
+        rows = cursor.fetchmany(chunk_size or cursor.arraysize)
+        if not rows:
+            break
+        for column, values in zip(columns, zip(*rows)):
+            column.extend(values)
+    return _columns_to_frame(columns, col_names)
+
+def query_database(sql_query, db_type='oracle', params=None):
     if db_type == 'oracle':
-        with oracledb.connect(user=creds['user'], password=creds['password'], dsn=creds['dsn']) as connection:
+        with _get_oracle_pool().acquire() as connection:
             with connection.cursor() as cursor:
+                cursor.arraysize = ORACLE_ARRAYSIZE
+                cursor.prefetchrows = ORACLE_ARRAYSIZE + 1
                 cursor.execute(sql_query, params or {})
                 col_names = [c.name for c in cursor.description]
-                data = cursor.fetchall()
-                return pd.DataFrame(data, columns=col_names)
+                return _fetch_dataframe(cursor, col_names)
 
     elif db_type == 'postgres':
         import psycopg
+        creds = get_db_credentials(db_type)
         conn_str = (
             f"dbname={creds['dbname']} user={creds['user']} "
             f"password={creds['password']} host={creds['host']} port={creds['port']}"
         )
+        # Server-side (named) cursor: rows come over in itersize batches instead of
+        # the whole result being buffered client-side by execute()
         with psycopg.connect(conn_str) as connection:
-            with connection.cursor() as cursor:
+            with connection.cursor(name='query_database') as cursor:
+                cursor.itersize = POSTGRES_FETCH_SIZE
                 cursor.execute(sql_query, params or {})
                 col_names = [desc.name for desc in cursor.description]
-                data = cursor.fetchall()
-                return pd.DataFrame(data, columns=col_names)
+                return _fetch_dataframe(cursor, col_names, POSTGRES_FETCH_SIZE)
 
-def execute_database(sql_query, db_type='oracle', params=None):
-    creds = get_db_credentials(db_type)
+    else:
+        raise ValueError("Unsupported database type")
 
+def query_database_chunks(sql_query, db_type='oracle', params=None, chunk_size=None):
+    """
+    Like query_database, but yields the result as a sequence of DataFrames of at
+    most chunk_size rows (default: the cursor arraysize) while the cursor stays
+    open. Callers that can work batch by batch never hold the full result.
+    """
     if db_type == 'oracle':
-        with oracledb.connect(user=creds['user'], password=creds['password'], dsn=creds['dsn']) as connection:
+        with _get_oracle_pool().acquire() as connection:
             with connection.cursor() as cursor:
+                cursor.arraysize = chunk_size or ORACLE_ARRAYSIZE
+                cursor.prefetchrows = cursor.arraysize + 1
                 cursor.execute(sql_query, params or {})
+                col_names = [c.name for c in cursor.description]
+                yield from _iter_frames(cursor, col_names)
+
+    elif db_type == 'postgres':
+        import psycopg
+        creds = get_db_credentials(db_type)
+        conn_str = (
+            f"dbname={creds['dbname']} user={creds['user']} "
+            f"password={creds['password']} host={creds['host']} port={creds['port']}"
+        )
+        with psycopg.connect(conn_str) as connection:
+            with connection.cursor(name='query_database_chunks') as cursor:
+                cursor.itersize = chunk_size or POSTGRES_FETCH_SIZE
+                cursor.execute(sql_query, params or {})
+                col_names = [desc.name for desc in cursor.description]
+                yield from _iter_frames(cursor, col_names, cursor.itersize)
+
+    else:
+        raise ValueError("Unsupported database type")
+
+def execute_database(sql_query, db_type='oracle', params=None):
+    """
+    Run a DML statement and commit. params may be a single bind dict, or a list
+    of bind dicts to run the statement once per entry in a single executemany()
+    round-trip and one commit.
+    """
+    if db_type == 'oracle':
+        with _get_oracle_pool().acquire() as connection:
+            with connection.cursor() as cursor:
+                if isinstance(params, list):
+                    cursor.executemany(sql_query, params)
+                else:
+                    cursor.execute(sql_query, params or {})
             connection.commit()
             return
 
     elif db_type == 'postgres':
         import psycopg
+        creds = get_db_credentials(db_type)
         conn_str = (
             f"dbname={creds['dbname']} user={creds['user']} "
             f"password={creds['password']} host={creds['host']} port={creds['port']}"
         )
         with psycopg.connect(conn_str) as connection:
             with connection.cursor() as cursor:
-                cursor.execute(sql_query, params or {})
+                if isinstance(params, list):
+                    cursor.executemany(sql_query, params)
+                else:
+                    cursor.execute(sql_query, params or {})
             connection.commit()
             return
-            
+
+    else:
+        raise ValueError("Unsupported database type")
+
+CSV_WRITE_BUFFER = 1 << 20
+
+# Directories already created by this process; later calls skip the filesystem entirely.
+_CREATED_DIRS = set()
+
+def _ensure_dir(path):
+    if path in _CREATED_DIRS:
+        return
+    os.makedirs(path, exist_ok=True)
+    _CREATED_DIRS.add(path)
+
 def save_to_csv(df, directory='logs'):
     today_date = datetime.today().strftime('%Y-%m-%d')
     file_name = f'data_{today_date}.csv'
-    if not os.path.exists(directory):
-        os.makedirs(directory)
+    _ensure_dir(directory)
     file_path = os.path.join(directory, file_name)
-    df.to_csv(file_path, index=False)
+    # pandas' C writer formats rows in chunks; a 1 MiB file buffer keeps the
+    # writes to disk large instead of one syscall per chunk.
+    with open(file_path, 'w', newline='', encoding='utf-8', buffering=CSV_WRITE_BUFFER) as f:
+        df.to_csv(f, index=False)
     return file_path
 
 
-def log_email_status(recipient, status):
-    # Create logs directory if it doesn't exist
+def _html_cell(value) -> str:
+    """
+    One table cell's text: blank for missing values, date-only values (including
+    datetimes at midnight) as YYYY-MM-DD, other datetimes with their time; HTML-escaped.
+    """
+    if value is None or value != value:
+        return ''
+    if hasattr(value, 'strftime'):
+        if not any(getattr(value, f, 0) for f in ('hour', 'minute', 'second', 'microsecond')):
+            return value.strftime('%Y-%m-%d')
+        return value.isoformat(sep=' ')
+    return html.escape(str(value))
+
+def table_html(email_table, url_field) -> str:
+    """
+    Render a notification DataFrame as an HTML table in one string build; the
+    url_field column is shown as a 'link' anchor.
+    """
+    url_idx = email_table.columns.get_loc(url_field)
+    header = "".join(f"<th>{html.escape(c)}</th>" for c in email_table.columns)
+    body_rows = "\n".join(
+        "<tr>" + "".join(
+            f'<td><a href="{_html_cell(v)}">link</a></td>' if i == url_idx else f"<td>{_html_cell(v)}</td>"
+            for i, v in enumerate(row)
+        ) + "</tr>"
+        for row in email_table.itertuples(index=False, name=None)
+    )
+    return (
+        "<table style='border-collapse:collapse' border='1' cellpadding='6'>"
+        f"<thead><tr>{header}</tr></thead>"
+        f"<tbody>{body_rows}</tbody></table>"
+    )
+
+def excel_attachment(email_table, url_field) -> MIMEBase:
+    """
+    Render a notification DataFrame as an .xlsx attachment; the url_field column
+    keeps its position and is written as 'link' hyperlinks.
+    """
+    # Attachment-only import; the small-table path never loads it
+    import io
+    url_col = email_table.columns.get_loc(url_field)
+    excel_buffer = io.BytesIO()
+    with pd.ExcelWriter(excel_buffer, engine='xlsxwriter') as writer:
+        # Blank the URL cells so to_excel still writes that column's header (with
+        # the pandas header format) in place, and the URLs are written only once
+        email_table.assign(**{url_field: None}).to_excel(writer, index=False, sheet_name='Sheet1')
+        worksheet = writer.sheets['Sheet1']
+        for row, url in enumerate(email_table[url_field].to_numpy(), start=1):
+            if isinstance(url, str):
+                worksheet.write_url(row, url_col, url, string='link')
+    attachment = MIMEBase('application', 'vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    attachment.set_payload(excel_buffer.getvalue())
+    return attachment
+
+
+def _email_log_path():
     log_directory = 'logs/email_logs'
-    if not os.path.exists(log_directory):
-        os.makedirs(log_directory)
+    _ensure_dir(log_directory)
+    # One log file per day; every status row of the day is appended to it
+    return os.path.join(log_directory, f'email_log_{datetime.now().strftime("%Y%m%d")}.csv')
 
 
+# Daily email log path -> (buffered handle, csv writer). One handle stays open per
+# process instead of an open/append/close per recipient; closed (and flushed) at exit.
+_EMAIL_LOG_FILES = {}
+_EMAIL_LOG_LOCK = threading.Lock()
 
-    # Create a new log file with datetime appended to the end of it
-    log_filename = f'email_log_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
-    log_filepath = os.path.join(log_directory, log_filename)
-
-    with open(log_filepath, mode='a', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow([recipient, datetime.now(), status])
+def _close_email_logs():
+    with _EMAIL_LOG_LOCK:
+        for file, _ in _EMAIL_LOG_FILES.values():
+            file.close()
+        _EMAIL_LOG_FILES.clear()
 
+atexit.register(_close_email_logs)
 
+def log_email_status(recipient, status):
+    path = _email_log_path()
+    with _EMAIL_LOG_LOCK:
+        entry = _EMAIL_LOG_FILES.get(path)
+        if entry is None:
+            # First row of the process, or the day rolled over: drop yesterday's handle
+            for file, _ in _EMAIL_LOG_FILES.values():
+                file.close()
+            _EMAIL_LOG_FILES.clear()
+            file = open(path, mode='a', newline='', buffering=1 << 16)
+            entry = _EMAIL_LOG_FILES[path] = (file, csv.writer(file))
+        entry[1].writerow([recipient, datetime.now(), status])
+
+
+# DEV_EMAIL is ','-separated; to_email and BCC_EMAIL are ';'-separated.
+def _parse_addrs(value, sep):
+    """
+    Split a recipient string on its own separator into stripped, non-empty
+    addresses. Only that separator counts, so a display name such as
+    '"Doe, Jane" <j@x>' stays a single recipient.
+    """
+    return [addr.strip() for addr in (value or '').split(sep) if addr.strip()]
+
+
+# Domain -> (lookup time, MX records or the lookup error). Batches repeat the same
+# few domains, so each one is resolved once per MX_CACHE_TTL seconds.
+MX_CACHE_TTL = int(os.getenv('MX_CACHE_TTL', '3600'))
+_MX_CACHE = {}
+
+# One shared resolver with bounded timeouts (dnspython's default lifetime is
+# several seconds per lookup), and a bounded SMTP probe, so a single slow domain
+# cannot hold up a validation batch.
+_RESOLVER = dns.resolver.Resolver(configure=True)
+_RESOLVER.timeout = float(os.getenv('DNS_TIMEOUT', '1.0'))
+_RESOLVER.lifetime = float(os.getenv('DNS_LIFETIME', '2.0'))
+SMTP_VERIFY_TIMEOUT = float(os.getenv('SMTP_VERIFY_TIMEOUT', '5'))
+
+def _resolve_mx(domain):
+    now = time.monotonic()
+    hit = _MX_CACHE.get(domain)
+    if hit is None or now - hit[0] >= MX_CACHE_TTL:
+        try:
+            # Most preferred (lowest preference value) exchange first
+            result = sorted(_RESOLVER.resolve(domain, 'MX'), key=lambda r: r.preference)
+        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer) as e:
+            result = e
+        hit = _MX_CACHE[domain] = (now, result)
+    if isinstance(hit[1], Exception):
+        raise hit[1]
+    return hit[1]
 
 def validate_email(email):
     # Get domain from email
     domain = email.split('@')[1]
 
-    dev_email = [email.strip() for email in os.environ.get('DEV_EMAIL', '').split(',') if email.strip()]
+    dev_email = _email_config()['dev_to']
 
     # Check if domain has valid MX records
     try:
-        mx_records = dns.resolver.resolve(domain, 'MX')
+        mx_records = _resolve_mx(domain)
     except dns.resolver.NXDOMAIN:
         return False, "Domain does not exist"
     except dns.resolver.NoAnswer:
         return False, "No MX records found"
+    except dns.exception.Timeout:
+        return False, "MX lookup timed out"
 
     # SMTP verification
     try:
         mx_record = str(mx_records[0].exchange)
-        server = smtplib.SMTP(mx_record)
+        server = smtplib.SMTP(mx_record, timeout=SMTP_VERIFY_TIMEOUT)
         server.set_debuglevel(0)
         server.helo()
         server.mail(dev_email)
@@ -235,55 +485,166 @@ def validate_email(email):
     except Exception as e:
         return False, f"SMTP verification failed: {str(e)}"
 
+def validate_emails(emails, max_workers=32):
+    """
+    Run validate_email over many addresses concurrently; each check is almost all
+    DNS/SMTP wait time. Returns {email: (is_valid, message)}. MX lookups share
+    the _MX_CACHE, so a batch resolves each domain about once.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(validate_email, email): email for email in set(emails)}
+        return {futures[future]: future.result() for future in as_completed(futures)}
+
+
+
+def _smtp_connect(smtp=None, mail_server=None):
+    """
+    Open an SMTP session to MAIL_SERVER and greet it, or re-establish an existing
+    (dropped) smtp object in place. Every session is set up here, so a reconnect
+    goes through exactly the same steps as the first connect and never reuses the
+    old session's EHLO capabilities.
+    """
+    host = mail_server or _email_config()['mail_server']
+    if smtp is None:
+        smtp = smtplib.SMTP()
+    else:
+        smtp.close()
+    smtp.connect(host=host)
+    # Same fallback as smtplib's ehlo_or_helo_if_needed, but always re-greeting
+    code, _ = smtp.ehlo()
+    if not (200 <= code <= 299):
+        smtp.helo()
+    return smtp
+
+@contextmanager
+def smtp_session(mail_server=None):
+    """
+    Open one SMTP connection to MAIL_SERVER that can be shared by a batch of
+    send_email(..., smtp=s) calls, instead of reconnecting for every message.
+    """
+    s = _smtp_connect(mail_server=mail_server)
+    try:
+        yield s
+    finally:
+        try:
+            s.quit()
+        except smtplib.SMTPServerDisconnected:
+            pass
+
 
+_EMAIL_CONFIG = None
 
-def send_email(to_email, fromname, fromaddr, subject, body, filename=None, attachment=None):
-    fromname = fromname
-    fromaddr = fromaddr
-    environment = os.environ.get('ENVIRONMENT')
-    mail_server = os.environ.get('MAIL_SERVER')
+def _email_config():
+    """
+    ENVIRONMENT, MAIL_SERVER and the parsed DEV_EMAIL / BCC_EMAIL lists, read once on
+    the first send. Scripts set ENVIRONMENT in main() (e.g. --dev) before sending, so
+    this is resolved lazily rather than at import time.
+    """
+    global _EMAIL_CONFIG
+    if _EMAIL_CONFIG is None:
+        _EMAIL_CONFIG = {
+            'environment': os.environ.get('ENVIRONMENT'),
+            'mail_server': os.environ.get('MAIL_SERVER'),
+            'dev_to': _parse_addrs(os.environ.get('DEV_EMAIL'), ','),
+            'bcc': _parse_addrs(os.environ.get('BCC_EMAIL'), ';'),
+        }
+    return _EMAIL_CONFIG
+
+def reload_email_config():
+    """Drop the cached email settings so the next send re-reads the environment."""
+    global _EMAIL_CONFIG
+    _EMAIL_CONFIG = None
+
+
+def send_email(to_email, fromname, fromaddr, subject, body, filename=None, attachment=None, smtp=None):
+    config = _email_config()
+    environment = config['environment']
+    mail_server = config['mail_server']
 
     print(environment)
 
     if environment == 'dev':
-        toaddr = [email.strip() for email in os.environ.get('DEV_EMAIL', '').split(',') if email.strip()]
+        toaddr = config['dev_to']
         print(toaddr)
     elif environment == 'prod':
-        toaddr = [email.strip() for email in to_email.split(';') if email.strip()]
+        toaddr = _parse_addrs(to_email, ';')
     else:
         raise Exception("No environment has been specified")
 
-    bcc = [email.strip() for email in os.environ.get('BCC_EMAIL', '').split(';') if email.strip()]
+    bcc = config['bcc']
 
-    msg = MIMEMultipart("alternative")
+    # Bcc recipients only go on the envelope, never into the message headers
+    msg = EmailMessage()
     msg["From"] = f"{fromname} <{fromaddr}>"
     msg["To"] = ', '.join(toaddr)
-    msg["Bcc"] = ', '.join(bcc)
     msg["Subject"] = subject
-    part1 = MIMEText(body, 'html')
-    msg.attach(part1)
+    msg.set_content(body, subtype='html')
+
+    if attachment is not None:
+        # A MIMEBase part carrying the raw bytes (as the notification scripts build it),
+        # or plain bytes / a binary file object
+        if isinstance(attachment, MIMEBase):
+            maintype, subtype = attachment.get_content_maintype(), attachment.get_content_subtype()
+            data = attachment.get_payload(decode=True)
+        else:
+            maintype, subtype = 'application', 'octet-stream'
+            data = attachment.read() if hasattr(attachment, 'read') else attachment
+        msg.add_attachment(data, maintype=maintype, subtype=subtype, filename=filename)
 
-    if attachment:
-        attachment.set_payload(attachment.read())
-        encoders.encode_base64(attachment)
-        attachment.add_header('Content-Disposition', f'attachment; filename="{filename}"')
-        msg.attach(attachment)
-    
+    # Serialize (and base64-encode any attachment) once; every RCPT on the envelope,
+    # and a resend after a dropped connection, reuses the same bytes
+    data = msg.as_bytes(policy=policy.SMTP)
+    rcpts = toaddr + bcc
 
+    if smtp is None:
+        with _smtp_connect(mail_server=mail_server) as s:
+            s.sendmail(fromaddr, rcpts, data)
+        return
 
-    with smtplib.SMTP(host=mail_server) as s:
-        s.sendmail(fromaddr, toaddr + bcc, msg.as_string())
+    # Shared connection from smtp_session(): reconnect once if the server dropped it
+    try:
+        smtp.sendmail(fromaddr, rcpts, data)
+    except smtplib.SMTPServerDisconnected:
+        _smtp_connect(smtp, mail_server=mail_server)
+        smtp.sendmail(fromaddr, rcpts, data)
 
 
-# ---------- Reusable logging + monitoring (add to utils.py) ----------
-import logging
-from logging import Logger
-from pathlib import Path
-from datetime import datetime
-import traceback
-import uuid
-import pandas as pd  # pandas is already used elsewhere in utils; safe to import
-import os
+def send_emails(jobs, max_workers=None):
+    """
+    Send a batch of emails concurrently on a bounded thread pool.
+
+    jobs is an iterable of (tag, kwargs) pairs, where kwargs are send_email
+    keyword arguments and tag is anything the caller wants handed back.
+    Each worker thread opens one SMTP connection on first use and reuses it
+    for all of its sends. Yields (tag, error) as each send completes, with
+    error None on success; all connections are closed when the batch is done.
+    """
+    local = threading.local()
+    sessions = []
+    lock = threading.Lock()
+
+    def _send(kwargs):
+        smtp = getattr(local, 'smtp', None)
+        if smtp is None:
+            smtp = local.smtp = _smtp_connect()
+            with lock:
+                sessions.append(smtp)
+        send_email(**kwargs, smtp=smtp)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers or EMAIL_POOL_SIZE) as pool:
+            futures = {pool.submit(_send, kwargs): tag for tag, kwargs in jobs}
+            for future in as_completed(futures):
+                yield futures[future], future.exception()
+    finally:
+        for smtp in sessions:
+            try:
+                smtp.quit()
+            except smtplib.SMTPException:
+                pass
+
+
+# ---------- Reusable logging + monitoring ----------
 
 def _today_str():
     return datetime.now().strftime("%Y-%m-%d")
@@ -301,13 +662,17 @@ def get_log_paths(job_code: str, base_dir: str = "logs") -> dict:
     date_str = _today_str()
     ymd = _ymd_compact()
     base = Path(base_dir) / job_code / date_str
-    base.mkdir(parents=True, exist_ok=True)
+    _ensure_dir(str(base))
     return {
         "dir": str(base),
         "txt": str(base / f"{job_code}_{ymd}.log"),
         "sent_csv": str(base / f"{job_code}_sent_{ymd}.csv"),
     }
 
+LOG_MAX_BYTES = 10 << 20
+LOG_BACKUP_COUNT = 5
+_LOG_LISTENERS = {}
+
 def init_daily_logger(job_code: str, base_dir: str = "logs",
                       level: int = logging.INFO,
                       console: bool = True) -> tuple[Logger, str]:
@@ -321,50 +686,74 @@ def init_daily_logger(job_code: str, base_dir: str = "logs",
     logger.setLevel(level)
     # Avoid duplicate handlers if called twice in same process
     if not logger.handlers:
-        fh = logging.FileHandler(log_path, encoding="utf-8")
+        fh = logging.handlers.RotatingFileHandler(
+            log_path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"
+        )
         fmt = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s", "%Y-%m-%d %H:%M:%S")
         fh.setFormatter(fmt)
-        logger.addHandler(fh)
+        handlers = [fh]
         if console:
             ch = logging.StreamHandler()
             ch.setFormatter(fmt)
-            logger.addHandler(ch)
+            handlers.append(ch)
+        # Callers (including send_emails worker threads) only enqueue records;
+        # the file/console writes happen on the listener's background thread.
+        log_queue = queue.SimpleQueue()
+        logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        listener.start()
+        # Only running listeners are kept here; _stop_daily_logger removes it at exit
+        _LOG_LISTENERS[job_code] = listener
+        atexit.register(_stop_daily_logger, job_code)
     return logger, log_path
 
+def _flush_daily_logger(job_code: str) -> None:
+    """Drain the job's log queue to disk (stop() processes everything queued, then restart)."""
+    listener = _LOG_LISTENERS.get(job_code)
+    if listener is not None:
+        listener.stop()
+        listener.start()
+
+def _stop_daily_logger(job_code: str) -> None:
+    """atexit hook: stop the job's listener (draining its queue) and forget it."""
+    listener = _LOG_LISTENERS.pop(job_code, None)
+    if listener is not None:
+        listener.stop()
+
 def append_sent_records(job_code: str, rows, base_dir: str = "logs",
-                        add_metadata: dict | None = None) -> str:
+                        add_metadata: dict | None = None, inplace: bool = False) -> str:
     """
     Append successful notification rows to today's CSV.
     `rows` can be:
       - a pandas DataFrame, or
       - a list of dicts (will be converted to DataFrame).
     Adds optional metadata (job_run_id, environment, etc.) as extra columns.
+    With inplace=True a DataFrame is annotated directly instead of copied first
+    (for callers that built it just for this call).
     Returns the CSV path.
     """
     paths = get_log_paths(job_code, base_dir)
     csv_path = paths["sent_csv"]
 
     if isinstance(rows, pd.DataFrame):
-        df = rows.copy()
+        df = rows if inplace else rows.copy()
     elif isinstance(rows, list):
         df = pd.DataFrame(rows)
     else:
         raise TypeError("append_sent_records expects a DataFrame or a list of dicts")
 
-    # Attach metadata
-    meta = add_metadata or {}
-    meta_cols = {k: [v] * len(df) for k, v in meta.items()}
-    if meta_cols:
-        meta_df = pd.DataFrame(meta_cols)
-        df = pd.concat([df.reset_index(drop=True), meta_df.reset_index(drop=True)], axis=1)
+    # Attach metadata; scalars broadcast down the column
+    for k, v in (add_metadata or {}).items():
+        df[k] = v
 
     # Add a run timestamp column for audit
     if "run_timestamp" not in df.columns:
         df["run_timestamp"] = datetime.now().isoformat(timespec="seconds")
 
-    # Append with header if file doesn't exist
-    header = not Path(csv_path).exists()
-    df.to_csv(csv_path, mode="a", index=False, header=header, encoding="utf-8")
+    # Append with header if the file is new/empty; an append handle opens at EOF,
+    # so tell() answers that without a separate stat
+    with open(csv_path, "a", newline="", encoding="utf-8", buffering=CSV_WRITE_BUFFER) as f:
+        df.to_csv(f, index=False, header=f.tell() == 0)
     return csv_path
 
 def _resolve_monitor_to(notification_prefix: str | None = None) -> str | None:
@@ -382,6 +771,45 @@ def _resolve_monitor_to(notification_prefix: str | None = None) -> str | None:
             return val
     return os.getenv("MONITOR_TO")
 
+# Failure-alert markup, built once; send_failure_alert only fills in the (escaped) values.
+_ALERT_LOG_PRE = "<pre style='white-space:pre-wrap;background:#f6f8fa;padding:8px;border:1px solid #e1e4e8;'>"
+_ALERT_EXC_PRE = "<pre style='white-space:pre-wrap;background:#fff5f5;padding:8px;border:1px solid #fed7d7;'>"
+_ALERT_BODY = Template("""
+            <div style="font-family:Segoe UI,Arial,sans-serif;font-size:13px;color:#24292f;">
+              <p><strong>Job Failure</strong></p>
+              <ul>
+                <li><strong>Job</strong>: $job_code</li>
+                <li><strong>Run ID</strong>: $job_run_id</li>
+                <li><strong>When</strong>: $now</li>
+                <li><strong>Environment</strong>: $env</li>
+                $meta_html_items
+              </ul>
+              <p><strong>Error Traceback</strong></p>
+              $exc_html
+              <p><strong>Last log lines</strong></p>
+              $last_lines_html
+              <p style="color:#6a737d;">This alert was generated automatically.</p>
+            </div>
+        """)
+
+def _tail_lines(path, n, max_bytes=64 * 1024):
+    """
+    Last n lines of a text file, read from the end in growing blocks (8 KiB,
+    doubling up to max_bytes) rather than reading the whole file.
+    """
+    with open(path, "rb") as f:
+        end = f.seek(0, os.SEEK_END)
+        size = min(end, 8192)
+        while True:
+            f.seek(end - size)
+            data = f.read(size)
+            # n newlines guarantee n complete lines; also stop at the start of file or the cap
+            if data.count(b"\n") > n or size == end or size >= max_bytes:
+                break
+            size = min(end, size * 2, max_bytes)
+    lines = data.decode("utf-8", errors="ignore").splitlines(keepends=True)
+    return "".join(lines[-n:])
+
 def send_failure_alert(job_code: str, error: Exception,
                        logger: Logger | None = None,
                        notification_prefix: str | None = None,
@@ -405,46 +833,31 @@ def send_failure_alert(job_code: str, error: Exception,
         try:
             paths = get_log_paths(job_code)
             log_file = paths["txt"]
+            # The caller usually logged the exception just before calling us
+            _flush_daily_logger(job_code)
             if os.path.exists(log_file):
-                with open(log_file, "r", encoding="utf-8", errors="ignore") as f:
-                    lines = f.readlines()
-                    tail = "".join(lines[-50:])  # last 50 lines
-                    last_lines_html = (
-                        "<pre style='white-space:pre-wrap;background:#f6f8fa;padding:8px;border:1px solid #e1e4e8;'>"
-                        + (tail.replace("<", "&lt;").replace(">", "&gt;"))
-                        + "</pre>"
-                    )
+                tail = _tail_lines(log_file, 50)  # last 50 lines
+                last_lines_html = _ALERT_LOG_PRE + html.escape(tail) + "</pre>"
         except Exception:
             pass
 
         # Exception detail
-        exc_html = (
-            "<pre style='white-space:pre-wrap;background:#fff5f5;padding:8px;border:1px solid #fed7d7;'>"
-            + (traceback.format_exc().replace("<", "&lt;").replace(">", "&gt;"))
-            + "</pre>"
-        )
+        exc_html = _ALERT_EXC_PRE + html.escape(traceback.format_exc()) + "</pre>"
 
         subject = f"[Monitor][{env.upper()}] Job '{job_code}' FAILED (run_id={job_run_id})"
         meta_html_items = "".join(
-            f"<li><strong>{k}</strong>: {v}</li>" for k, v in ctx.items()
+            f"<li><strong>{html.escape(str(k))}</strong>: {html.escape(str(v))}</li>"
+            for k, v in ctx.items()
+        )
+        body = _ALERT_BODY.substitute(
+            job_code=html.escape(job_code),
+            job_run_id=html.escape(str(job_run_id)),
+            now=now,
+            env=html.escape(env),
+            meta_html_items=meta_html_items,
+            exc_html=exc_html,
+            last_lines_html=last_lines_html or '<p><em>No log lines available</em></p>',
         )
-        body = f"""
-            <div style="font-family:Segoe UI,Arial,sans-serif;font-size:13px;color:#24292f;">
-              <p><strong>Job Failure</strong></p>
-              <ul>
-                <li><strong>Job</strong>: {job_code}</li>
-                <li><strong>Run ID</strong>: {job_run_id}</li>
-                <li><strong>When</strong>: {now}</li>
-                <li><strong>Environment</strong>: {env}</li>
-                {meta_html_items}
-              </ul>
-              <p><strong>Error Traceback</strong></p>
-              {exc_html}
-              <p><strong>Last log lines</strong></p>
-              {last_lines_html or '<p><em>No log lines available</em></p>'}
-              <p style="color:#6a737d;">This alert was generated automatically.</p>
-            </div>
-        """
 
         # Determine recipients
         to_prod = _resolve_monitor_to(notification_prefix=notification_prefix)